@@ -0,0 +1,659 @@
+# -------------------------------------------------------------
+# Shared club dataset
+# -------------------------------------------------------------
+# The dashboard loads the club's worksheets once per process into
+# a read-only Dataset that every session shares. Sessions get
+# shallow views of the frames: nothing is pickled or copied per
+# rerun, and with pandas copy-on-write (turned on by the app) a
+# session that modifies a view only copies the columns it touches,
+# never the shared data.
+#
+# DatasetRefresher keeps that Dataset current in the background,
+# reloading only when the spreadsheets have actually changed, and
+# DerivedState carries the club-wide aggregates forward a week at
+# a time instead of recomputing them from the whole history.
+# -------------------------------------------------------------
+
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from types import MappingProxyType, SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from data_sources import with_retries
+
+logger = logging.getLogger(__name__)
+
+# Process-wide counters for the data caches, read by load_test.py
+cache_stats = Counter()
+_cache_stats_lock = threading.Lock()
+
+
+def count_stat(name):
+    """Add one to a cache_stats counter; safe to call from any session thread."""
+    with _cache_stats_lock:
+        cache_stats[name] += 1
+
+
+def copy_on_write():
+    """True if pandas will copy a shared view's data before writing to it."""
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    return pd.get_option("mode.copy_on_write") is True
+
+
+# ------------------------
+# Worksheet schemas
+# ------------------------
+
+@dataclass(frozen=True)
+class Column:
+    """How one worksheet column is found and parsed.
+
+    kind is one of text, flag (stripped + upper-cased), number, integer,
+    date, category or list. Columns with a position are matched by place in
+    the header row, since the meets sheet's headings are free text; the rest
+    are matched by name. A list column is split on separator and exploded
+    into one row per item under explode_to, alongside just the columns
+    named in carry, with the item count stored as "<explode_to>Count".
+    """
+
+    name: str
+    kind: str = "text"
+    position: int = None
+    required: bool = True
+    default: str = None  # fill for a missing optional column; None leaves it out
+    date_formats: tuple = ()
+    separator: str = ","
+    explode_to: str = None
+    carry: tuple = ()
+
+
+@dataclass(frozen=True)
+class Schema:
+    worksheet: str
+    columns: tuple
+    keys: tuple  # rows with a blank or unparsable value here are dropped
+
+
+MEETS_SCHEMA = Schema(
+    worksheet="Run Club Meets",
+    keys=("Date",),
+    columns=(
+        Column("Week", "number", position=0),
+        Column("Date", "date", position=1, date_formats=("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d")),
+        Column("Runners", "list", position=2, separator=",", explode_to="Runner",
+               carry=("Week", "Date", "Location", "Distance")),
+        Column("Location", "category", position=3),
+        Column("Distance", "number", position=4),
+        Column("Pints Consumed", "flag", required=False, default=""),
+        Column("Run Club Baby Count", required=False),
+        Column("Injuries", required=False),
+    ),
+)
+
+RUNNERS_SCHEMA = Schema(
+    worksheet="Runners",
+    keys=("name", "capnumber"),
+    columns=(
+        Column("name"),
+        Column("capnumber", "integer"),
+    ),
+)
+
+REPORT_COLUMNS = ["Worksheet", "Row", "Column", "Value", "Problem", "Action"]
+
+
+# ------------------------
+# Vectorised ingest
+# ------------------------
+
+def _parse_dates(text, formats):
+    parsed = pd.to_datetime(text, format=formats[0], errors="coerce")
+    for fmt in formats[1:]:
+        retry = parsed.isna() & (text != "")
+        if not retry.any():
+            break
+        parsed[retry] = pd.to_datetime(text[retry], format=fmt, errors="coerce")
+    return parsed
+
+
+def _parse_column(text, column):
+    """Return (parsed values, mask of non-blank cells that failed to parse)."""
+    if column.kind == "flag":
+        return text.str.upper(), None
+    if column.kind == "category":
+        return text.mask(text == "").astype("category"), None
+    if column.kind == "date":
+        parsed = _parse_dates(text, column.date_formats)
+    elif column.kind in ("number", "integer"):
+        parsed = pd.to_numeric(text, errors="coerce")
+        if column.kind == "integer":
+            parsed = parsed.where(parsed % 1 == 0).astype("Int64")
+    else:
+        return text, None
+    return parsed, parsed.isna() & (text != "")
+
+
+def ingest(values, schema):
+    """Parse raw worksheet values into a typed frame.
+
+    Returns (frame, exploded, report). exploded is one row per list item
+    (None when the schema has no list column) and report lists every cell
+    that was dropped or blanked, with its sheet row number and the reason.
+    """
+    header = [h.strip() for h in values[0]] if values else []
+    raw = pd.DataFrame(values[1:], dtype=object)
+    raw = raw.reindex(columns=range(max(raw.shape[1], len(header)))).fillna("")
+    sheet_rows = pd.Series(raw.index + 2, index=raw.index)  # row 1 is the header
+
+    texts = {}
+    parsed = {}
+    for column in schema.columns:
+        position = column.position
+        if position is None and column.name in header:
+            position = header.index(column.name)
+        if position is None or position >= raw.shape[1]:
+            if column.required:
+                raise ValueError(f"{schema.worksheet} has no {column.name!r} column")
+            if column.default is not None:
+                parsed[column.name] = pd.Series(column.default, index=raw.index)
+            continue
+        texts[column.name] = raw[position].astype(str).str.strip()
+
+    # Completely empty rows are just unused sheet space, not data problems
+    blank = pd.Series(True, index=raw.index)
+    for text in texts.values():
+        blank &= text == ""
+
+    problems = []
+    drop = blank.copy()
+
+    def note(mask, column, text, problem, action):
+        mask = mask & ~blank
+        if mask.any():
+            problems.append(pd.DataFrame({
+                "Worksheet": schema.worksheet,
+                "Row": sheet_rows[mask],
+                "Column": column,
+                "Value": text[mask],
+                "Problem": problem,
+                "Action": action,
+            }))
+
+    for column in schema.columns:
+        if column.name not in texts:
+            continue
+        text = texts[column.name]
+        parsed[column.name], failed = _parse_column(text, column)
+        is_key = column.name in schema.keys
+        if is_key:
+            note(text == "", column.name, text, f"missing {column.name}", "row dropped")
+            drop |= text == ""
+        if failed is not None:
+            note(failed, column.name, text, f"not a valid {column.kind}",
+                 "row dropped" if is_key else "value blanked")
+            if is_key:
+                drop |= failed
+
+    frame = pd.DataFrame(parsed)[~drop].reset_index(drop=True)
+
+    for column in schema.columns:
+        if column.name not in frame:
+            continue
+        if column.kind == "integer" and column.name in schema.keys:
+            frame[column.name] = frame[column.name].astype("int64")
+        elif column.kind == "category":
+            frame[column.name] = frame[column.name].cat.remove_unused_categories()
+
+    # After the clean-up above, so exploded picks up the final dtypes
+    exploded = None
+    for column in schema.columns:
+        if column.kind == "list" and column.name in frame:
+            items = frame[column.name].str.split(column.separator).explode().str.strip()
+            items = items[items.notna() & (items != "")]
+            frame[f"{column.explode_to}Count"] = items.groupby(level=0).size().reindex(frame.index, fill_value=0)
+            carried = [name for name in column.carry if name in frame]
+            exploded = frame.loc[items.index, carried]
+            exploded[column.explode_to] = pd.Categorical(items.to_numpy())
+
+    if problems:
+        report = pd.concat(problems, ignore_index=True).sort_values("Row", kind="stable")
+    else:
+        report = pd.DataFrame(columns=REPORT_COLUMNS)
+    return frame, exploded, report.reset_index(drop=True)
+
+
+# ------------------------
+# Derived aggregates
+# ------------------------
+
+MILESTONES = {5: "5️⃣", 10: "🔟", 15: "⚡", 20: "🚀", 25: "🥉", 50: "🥈", 100: "🏅"}
+PINTS_PER_RUNNER = 0.8  # assume 80% of runners get a pint on pub weeks
+
+MilestoneEvent = namedtuple("MilestoneEvent", ["Runner", "Runs", "Date", "Badge"])
+
+
+class OutOfOrderWeek(ValueError):
+    """A meet arrived for an earlier week than one already counted."""
+
+
+class SharedLog(Sequence):
+    """An immutable sequence that states can extend without copying.
+
+    Logs made by plus() share one underlying list, each seeing its own
+    prefix of it. Adding to the newest log appends in place; adding to an
+    older one (whose list a newer log has already grown) copies its prefix
+    first, so no log ever sees another's items.
+    """
+
+    __slots__ = ("_items", "_length")
+
+    def __init__(self, items=(), _length=None):
+        self._items = items if _length is not None else list(items)
+        self._length = len(self._items) if _length is None else _length
+
+    def plus(self, item):
+        items = self._items
+        if len(items) != self._length:
+            items = items[:self._length]
+        items.append(item)
+        return SharedLog(items, self._length + 1)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._items[:self._length][index]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("SharedLog index out of range")
+        return self._items[index]
+
+    def __iter__(self):
+        return itertools.islice(self._items, self._length)
+
+    def __eq__(self, other):
+        if not isinstance(other, SharedLog):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+
+class DerivedState:
+    """Club-wide aggregates, maintained one meet at a time.
+
+    extend() returns a new state with more meets folded in. It copies the
+    runner-keyed dicts once and then updates only the runners at those
+    meets, so adding a week costs time proportional to the club's roster,
+    not to the length of its meets history. build() folds the whole
+    history and is used for the first load and as a consistency check.
+
+    Streaks follow the dashboard's rules: the current streak counts back
+    through the weeks the club met, and the longest streak counts
+    consecutive week numbers. Meets must arrive in week order; extend()
+    raises OutOfOrderWeek otherwise and the caller should rebuild.
+    """
+
+    def __init__(self):
+        self.meets = 0
+        self.run_counts = {}
+        self.milestone_events = SharedLog()
+        self.club_km = 0.0
+        self.total_pints = 0.0
+        self.pint_weeks = SharedLog()  # (Week, Estimated Pints) for each pub week
+        self.pints_logged = 0  # meets with the Pints Consumed column filled in
+        self.location_counts = {}
+        self.runner_km = {}
+        self.runner_locations = {}  # runner -> frozenset of locations
+        self.current_streaks = {}
+        self.longest_streaks = {}
+        self._latest_week = None
+        self._streaks_before_latest = {}
+        self._last_attended = {}
+        self._run_streaks = {}
+
+    @classmethod
+    def build(cls, meets, exploded):
+        # Weekless rows stay where they are; everything else goes in week order
+        week_key = np.floor(meets["Week"].ffill().fillna(-np.inf).to_numpy())
+        return cls().extend(meets.iloc[np.argsort(week_key, kind="stable")], exploded)
+
+    def copy(self):
+        new = DerivedState.__new__(DerivedState)
+        new.__dict__.update(self.__dict__)
+        # Only the runner- and location-keyed dicts (so O(roster) per extend);
+        # the event logs are shared
+        for name, value in self.__dict__.items():
+            if isinstance(value, dict):
+                setattr(new, name, value.copy())
+        return new
+
+    def extend(self, meets, exploded):
+        """Return a new state with ``meets`` added.
+
+        ``exploded`` needs a row per runner for (at least) those meets,
+        indexed like ``meets``.
+        """
+        state = self.copy()
+        runners_by_meet = defaultdict(list)
+        for index, runner in zip(exploded.index, exploded["Runner"].astype(object)):
+            runners_by_meet[index].append(runner)
+        for index, week, date, location, distance, pints in zip(
+            meets.index,
+            meets["Week"].to_numpy(),
+            meets["Date"],
+            meets["Location"].astype(object).to_numpy(),
+            meets["Distance"].to_numpy(),
+            meets["Pints Consumed"].to_numpy(),
+        ):
+            state._add_meet(week, date, location, distance, pints, runners_by_meet.get(index, []))
+        return state
+
+    def _add_meet(self, week, date, location, distance, pints, runners):
+        self.meets += 1
+        if pd.notna(distance):
+            self.club_km += len(runners) * distance
+        if pints == "Y":
+            estimate = PINTS_PER_RUNNER * len(runners)
+            self.total_pints += estimate
+            self.pint_weeks = self.pint_weeks.plus((week, estimate))
+        if pints != "":
+            self.pints_logged += 1
+        if pd.notna(location):
+            self.location_counts[location] = self.location_counts.get(location, 0) + 1
+
+        for runner in runners:
+            count = self.run_counts.get(runner, 0) + 1
+            self.run_counts[runner] = count
+            if pd.notna(distance):
+                self.runner_km[runner] = self.runner_km.get(runner, 0.0) + distance
+            if pd.notna(location):
+                # Frozensets, so states sharing a set after copy() can't affect each other
+                self.runner_locations[runner] = self.runner_locations.get(runner, frozenset()) | {location}
+            if count in MILESTONES:
+                self.milestone_events = self.milestone_events.plus(
+                    MilestoneEvent(runner, count, date, MILESTONES[count])
+                )
+
+        if pd.isna(week):
+            return
+        week = int(np.floor(week))
+        if self._latest_week is None or week > self._latest_week:
+            # A new club week: anyone not at it loses their current streak
+            self._streaks_before_latest = self.current_streaks
+            self.current_streaks = {}
+            self._latest_week = week
+        elif week < self._latest_week:
+            raise OutOfOrderWeek(f"week {week} arrived after week {self._latest_week}")
+
+        for runner in set(runners):
+            if runner not in self.current_streaks:
+                self.current_streaks[runner] = self._streaks_before_latest.get(runner, 0) + 1
+            last = self._last_attended.get(runner)
+            if last != week:
+                self._run_streaks[runner] = self._run_streaks[runner] + 1 if last == week - 1 else 1
+                self._last_attended[runner] = week
+                self.longest_streaks[runner] = max(self.longest_streaks.get(runner, 0), self._run_streaks[runner])
+
+    def read_only(self):
+        """The public aggregates, as mappings and logs nobody can modify.
+
+        Built once per load and handed to every session, so it must not be
+        possible for a rerun to change the shared state through it.
+        """
+        view = {}
+        for name, value in vars(self).items():
+            if name.startswith("_"):
+                continue
+            if isinstance(value, dict):
+                value = MappingProxyType(value)
+            view[name] = value
+        return SimpleNamespace(**view)
+
+    def matches(self, other):
+        """True if both states hold the same aggregates."""
+        return (
+            self.meets == other.meets
+            and self.run_counts == other.run_counts
+            and self.milestone_events == other.milestone_events
+            and math.isclose(self.club_km, other.club_km)
+            and math.isclose(self.total_pints, other.total_pints)
+            and self.pint_weeks == other.pint_weeks
+            and self.pints_logged == other.pints_logged
+            and self.location_counts == other.location_counts
+            and self.runner_km.keys() == other.runner_km.keys()
+            and all(math.isclose(km, other.runner_km[r]) for r, km in self.runner_km.items())
+            and self.runner_locations == other.runner_locations
+            and self.current_streaks == other.current_streaks
+            and self.longest_streaks == other.longest_streaks
+        )
+
+
+class Rankings:
+    """Club-wide sorted distributions of the Wrapped metrics.
+
+    Built once per data load, so looking up where a runner sits is a
+    binary search per metric rather than a scan of every runner.
+    """
+
+    def __init__(self, derived):
+        runners = list(derived.run_counts)
+        locations = {r: len(locs) for r, locs in derived.runner_locations.items()}
+        self.values = MappingProxyType({
+            "Total runs": MappingProxyType(derived.run_counts),
+            "Total km": MappingProxyType(derived.runner_km),
+            "Longest streak": MappingProxyType(derived.longest_streaks),
+            "Locations": MappingProxyType(locations),
+        })
+        self.distributions = {}
+        for metric, values in self.values.items():
+            distribution = np.sort(np.array([values.get(r, 0) for r in runners], dtype=float))
+            distribution.flags.writeable = False  # shared by every session
+            self.distributions[metric] = distribution
+        self.distributions = MappingProxyType(self.distributions)
+
+    def rank(self, runner):
+        """One row per metric: the runner's value, their "top X%" and percentile.
+
+        Top % is the runner's competition rank (1 + the number of runners
+        strictly ahead) as a share of the club, rounded up: the leader of a
+        club of 60 is top 2%, and so is everyone tied with them. Percentile
+        is the share at or below. Returns an empty list for a runner with no
+        runs.
+        """
+        if runner not in self.values["Total runs"]:
+            return []
+        rows = []
+        for metric, distribution in self.distributions.items():
+            value = self.values[metric].get(runner, 0)
+            n = len(distribution)
+            at_or_below = np.searchsorted(distribution, value, side="right")
+            rank = n - at_or_below + 1
+            rows.append({
+                "Metric": metric,
+                "Value": value,
+                "Top %": math.ceil(100 * rank / n),
+                "Percentile": round(100 * at_or_below / n),
+            })
+        return rows
+
+
+def derive(meets, exploded, meets_values, previous=None, verify=False):
+    """DerivedState for freshly loaded meets, extending ``previous`` if we can.
+
+    New weeks are appended at the bottom of the sheet, so if the previous
+    load's raw rows are an unchanged prefix of this one only the new rows
+    need folding in. Anything else (an edited or reordered row) rebuilds.
+    """
+    if previous is not None and meets_values[:len(previous._meets_values)] == previous._meets_values:
+        start = len(previous._meets)
+        try:
+            state = previous._derived.extend(
+                meets.iloc[start:], exploded.iloc[exploded.index.searchsorted(start):]
+            )
+        except OutOfOrderWeek:
+            return DerivedState.build(meets, exploded)
+        if verify:
+            rebuilt = DerivedState.build(meets, exploded)
+            if not state.matches(rebuilt):
+                logger.warning("Incremental aggregates drifted from a full rebuild; using the rebuild")
+                return rebuilt
+        return state
+    return DerivedState.build(meets, exploded)
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """Everything one load produced, shared by every session in the process.
+
+    The frames are private: take views() to work with them. ``derived`` is
+    a read-only view of the aggregates (see DerivedState.read_only()).
+    """
+
+    _meets: pd.DataFrame
+    _runners: pd.DataFrame
+    _locations_cache: pd.DataFrame
+    _exploded: pd.DataFrame
+    _report: pd.DataFrame  # rows dropped or values blanked during ingest
+    _derived: DerivedState  # kept to extend on the next load
+    _meets_values: list  # raw meets rows, to spot appended weeks next load
+    derived: SimpleNamespace
+    rankings: Rankings
+
+    def views(self):
+        """Views of (meets, runners, locations_cache, exploded, report).
+
+        Under copy-on-write these are shallow and share memory with the
+        dataset: writing to one copies just the affected column for that
+        caller. Without it they're deep copies, so the shared frames stay
+        untouched either way.
+        """
+        deep = not copy_on_write()
+        return tuple(
+            frame.copy(deep=deep)
+            for frame in (self._meets, self._runners, self._locations_cache, self._exploded, self._report)
+        )
+
+
+def load_dataset(source, sheet_name, previous=None, verify=False):
+    """Load every worksheet into a new Dataset.
+
+    Pass the ``previous`` Dataset to carry its derived aggregates forward
+    incrementally; ``verify`` checks them against a full rebuild.
+    """
+    def fetch(schema):
+        return ingest(with_retries(source.get_all_values, sheet_name, schema.worksheet), schema)
+
+    def fetch_meets():
+        values = with_retries(source.get_all_values, sheet_name, MEETS_SCHEMA.worksheet)
+        meets, exploded, report = ingest(values, MEETS_SCHEMA)
+        derived = derive(meets, exploded, values, previous, verify)
+        return meets, exploded, report, values, derived, Rankings(derived)
+
+    # Fetch all three worksheets at once so the load costs roughly the slowest
+    # single request. Each worksheet is parsed on its own worker as soon as it
+    # arrives, overlapping with the other downloads.
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        meets_future = pool.submit(fetch_meets)
+        runners_future = pool.submit(fetch, RUNNERS_SCHEMA)
+        cache_future = pool.submit(
+            lambda: pd.DataFrame(with_retries(source.get_all_records, "locations_cache"))
+        )
+        meets, exploded, meets_report, meets_values, derived, rankings = meets_future.result()
+        runners, _, runners_report = runners_future.result()
+        report = pd.concat([meets_report, runners_report], ignore_index=True)
+        return Dataset(
+            meets, runners, cache_future.result(), exploded, report, derived, meets_values,
+            derived.read_only(), rankings,
+        )
+
+
+# ------------------------
+# Background refresh
+# ------------------------
+
+class DatasetRefresher:
+    """Keep the shared Dataset current without sessions waiting on fetches.
+
+    A daemon thread polls each workbook's fingerprint every ``interval``
+    seconds and reloads only when one has changed. The new Dataset is
+    built off to the side and swapped in with a single assignment, so a
+    rerun always sees either the old dataset or the new one, never a mix.
+    request_check() wakes the thread to poll straight away.
+    """
+
+    WORKBOOKS = ("locations_cache",)
+
+    def __init__(self, source, sheet_name, interval, verify=False):
+        if interval <= 0:
+            raise ValueError(f"refresh interval must be positive, got {interval}")
+        self.source = source
+        self.sheet_name = sheet_name
+        self.interval = interval
+        self.verify = verify
+        self.version = 1
+        self.last_checked = None
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+        # Fingerprint first, so a change made mid-load is picked up next poll
+        self._fingerprint = self._read_fingerprint()
+        self.dataset = load_dataset(source, sheet_name)
+        count_stat("dataset_loads")
+        self.last_checked = time.time()
+
+        self._thread = threading.Thread(target=self._poll, name="runclub-refresher", daemon=True)
+        self._thread.start()
+
+    def _read_fingerprint(self):
+        return tuple(
+            with_retries(self.source.fingerprint, workbook)
+            for workbook in (self.sheet_name, *self.WORKBOOKS)
+        )
+
+    def check(self):
+        """Reload if the sheets changed since the last load. True if reloaded."""
+        with self._check_lock:
+            fingerprint = self._read_fingerprint()
+            self.last_checked = time.time()
+            count_stat("dataset_checks")
+            if fingerprint == self._fingerprint:
+                return False
+            dataset = load_dataset(self.source, self.sheet_name, self.dataset, self.verify)
+            count_stat("dataset_loads")
+            self._fingerprint = fingerprint
+            self.dataset = dataset
+            self.version += 1
+            return True
+
+    def request_check(self):
+        """Ask the background thread to check now. Returns immediately."""
+        self._wake.set()
+
+    def _poll(self):
+        while True:
+            self._wake.wait(self.interval)
+            # Presses that arrive during the check below get a check of their own
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.check()
+            except Exception:
+                # Keep serving the current dataset and try again next poll
+                logger.exception("Background refresh failed")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
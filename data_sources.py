@@ -0,0 +1,311 @@
+# -------------------------------------------------------------
+# Data sources for the Run Club Dashboard
+# -------------------------------------------------------------
+# Every read and write the dashboard makes against the club's
+# spreadsheets goes through a SheetsSource:
+#
+#   GoogleSheetsSource  – the live Google Sheets workbooks (gspread)
+#   LocalSheetsSource   – the same workbooks as CSV files on disk,
+#                         with optional latency, quota errors and
+#                         row limits for offline benchmarking
+#
+# Generate a synthetic club to point the local source at with:
+#
+#     python data_sources.py synth ./synthetic_sheets --weeks 150 --runners 60
+# -------------------------------------------------------------
+
+import csv
+import hashlib
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+
+class QuotaExceeded(Exception):
+    """The backend refused a call because the request quota was used up."""
+
+
+def numericise(value):
+    """Convert a cell to int/float the way gspread's get_all_records does."""
+    if value == "":
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def with_retries(fn, *args, attempts=3, backoff=1.0):
+    """Call fn(*args), retrying with exponential backoff on QuotaExceeded."""
+    for attempt in range(attempts):
+        try:
+            return fn(*args)
+        except QuotaExceeded:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+class SheetsSource(ABC):
+    """Interface shared by the live and local backends.
+
+    ``worksheet=None`` means the first sheet of the workbook, like gspread's
+    ``sheet1``.
+    """
+
+    @abstractmethod
+    def get_all_values(self, workbook, worksheet=None):
+        ...
+
+    @abstractmethod
+    def get_all_records(self, workbook, worksheet=None):
+        ...
+
+    @abstractmethod
+    def append_row(self, workbook, row, worksheet=None):
+        ...
+
+    @abstractmethod
+    def fingerprint(self, workbook):
+        """A cheap value that changes whenever the workbook's contents do."""
+
+    @abstractmethod
+    def geocode(self, query):
+        """Return (lat, lon) for a place name, or None if it can't be found."""
+
+
+# ------------------------
+# Live Google Sheets
+# ------------------------
+
+class GoogleSheetsSource(SheetsSource):
+    def __init__(self, credentials):
+        import gspread
+
+        self._gspread = gspread
+        # One authorised client for the whole process; gspread refreshes
+        # its token on expiry so it is reused across sessions.
+        self.client = gspread.authorize(credentials)
+        self._workbooks = {}
+        self._open_locks = defaultdict(threading.Lock)
+        self._guard = threading.Lock()
+        self._geocoder = None
+
+    def _open(self, workbook):
+        with self._guard:
+            lock = self._open_locks[workbook]
+        with lock:
+            if workbook not in self._workbooks:
+                self._workbooks[workbook] = self._call(self.client.open, workbook)
+            return self._workbooks[workbook]
+
+    def _worksheet(self, workbook, worksheet):
+        book = self._open(workbook)
+        if worksheet is None:
+            # Same as book.sheet1, but through _call so a 429 becomes QuotaExceeded
+            return self._call(book.get_worksheet, 0)
+        return self._call(book.worksheet, worksheet)
+
+    def _call(self, fn, *args):
+        try:
+            return fn(*args)
+        except self._gspread.exceptions.APIError as err:
+            if getattr(err.response, "status_code", None) == 429:
+                raise QuotaExceeded(str(err)) from err
+            raise
+
+    def get_all_values(self, workbook, worksheet=None):
+        return self._call(self._worksheet(workbook, worksheet).get_all_values)
+
+    def get_all_records(self, workbook, worksheet=None):
+        return self._call(self._worksheet(workbook, worksheet).get_all_records)
+
+    def append_row(self, workbook, row, worksheet=None):
+        self._call(self._worksheet(workbook, worksheet).append_row, row)
+
+    def fingerprint(self, workbook):
+        # Drive's modifiedTime: one small metadata request, no cell data
+        return self._call(self._open(workbook).get_lastUpdateTime)
+
+    def geocode(self, query):
+        if self._geocoder is None:
+            from geopy.geocoders import Nominatim
+            from geopy.extra.rate_limiter import RateLimiter
+
+            geolocator = Nominatim(user_agent="runclub-geocoder")
+            self._geocoder = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+        g = self._geocoder(query)
+        return (g.latitude, g.longitude) if g else None
+
+
+# ------------------------
+# Local file-backed stand-in
+# ------------------------
+
+class LocalSheetsSource(SheetsSource):
+    """Serve workbooks from ``<root>/<workbook>/<worksheet>.csv``.
+
+    latency      seconds slept on every call
+    quota_every  every Nth call raises QuotaExceeded (0 disables)
+    max_rows     serve at most this many data rows per worksheet
+
+    ``calls`` counts calls by method and ``reads`` counts reads by
+    (workbook, worksheet), across every local source in the process, so a
+    benchmark can see how often the dashboard hit the sheets.
+    """
+
+    FIRST_SHEET = "Sheet1"
+    calls = Counter()
+    reads = Counter()
+    _counts_lock = threading.Lock()  # the counters are shared by every instance
+
+    def __init__(self, root, latency=0.0, quota_every=0, max_rows=None):
+        self.root = root
+        self.latency = latency
+        self.quota_every = quota_every
+        self.max_rows = max_rows
+        self._n_calls = 0
+        self._lock = threading.Lock()
+
+    def _path(self, workbook, worksheet):
+        return os.path.join(self.root, workbook, f"{worksheet or self.FIRST_SHEET}.csv")
+
+    def _call(self, name):
+        with self._lock:
+            self._n_calls += 1
+            n = self._n_calls
+        with self._counts_lock:
+            self.calls[name] += 1
+        quota_hit = self.quota_every and n % self.quota_every == 0
+        if self.latency:
+            time.sleep(self.latency)
+        if quota_hit:
+            raise QuotaExceeded(f"simulated quota error on call {n}")
+
+    def _read(self, workbook, worksheet):
+        path = self._path(workbook, worksheet)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No local worksheet at {path}")
+        with self._counts_lock:
+            self.reads[(workbook, worksheet)] += 1
+        with self._lock, open(path, newline="", encoding="utf-8") as f:
+            values = list(csv.reader(f))
+        if self.max_rows is not None:
+            values = values[:self.max_rows + 1]
+        return values
+
+    def get_all_values(self, workbook, worksheet=None):
+        self._call("get_all_values")
+        return self._read(workbook, worksheet)
+
+    def get_all_records(self, workbook, worksheet=None):
+        self._call("get_all_records")
+        values = self._read(workbook, worksheet)
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, map(numericise, row))) for row in values[1:]]
+
+    def append_row(self, workbook, row, worksheet=None):
+        self._call("append_row")
+        path = self._path(workbook, worksheet)
+        with self._lock, open(path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(row)
+
+    def fingerprint(self, workbook):
+        self._call("fingerprint")
+        folder = os.path.join(self.root, workbook)
+        stats = []
+        for name in sorted(os.listdir(folder)):
+            info = os.stat(os.path.join(folder, name))
+            stats.append((name, info.st_mtime_ns, info.st_size))
+        return tuple(stats)
+
+    def geocode(self, query):
+        # Deterministic fake coordinates scattered around the Wirral
+        self._call("geocode")
+        digest = hashlib.md5(query.encode("utf-8")).digest()
+        return (53.37 + (digest[0] - 128) / 640, -3.04 + (digest[1] - 128) / 640)
+
+
+# ------------------------
+# Synthetic club data
+# ------------------------
+
+LOCATIONS = [
+    "Arrowe Park", "West Kirby", "New Brighton", "Thurstaston", "Hoylake",
+    "Birkenhead Park", "Eastham Country Park", "Royden Park", "Parkgate",
+    "Otterspool Promenade", "Sefton Park", "Crosby Beach",
+]
+
+
+def generate_synthetic_club(root, sheet_name, weeks=150, runners=60, seed=0):
+    """Write a synthetic club history the LocalSheetsSource can serve."""
+    rng = random.Random(seed)
+    names = [f"Runner {i:03d}" for i in range(1, runners + 1)]
+    # Some runners turn up most weeks, most only now and then
+    keenness = [rng.betavariate(1.2, 2.5) for _ in names]
+
+    meets = [["Week", "Date", "Runners", "Location", "Distance",
+              "Pints Consumed", "Run Club Baby Count", "Injuries"]]
+    start = date(2024, 1, 4)
+    for week in range(1, weeks + 1):
+        attendees = [n for n, k in zip(names, keenness) if rng.random() < k]
+        if not attendees:
+            attendees = [rng.choice(names)]
+        baby = ""
+        if rng.random() < 0.02:
+            caps = rng.sample(range(1, runners + 1), 2)
+            baby = f"Baby {week} (cap{caps[0]} cap{caps[1]})"
+        meets.append([
+            str(week),
+            (start + timedelta(weeks=week - 1)).strftime("%d/%m/%Y"),
+            ", ".join(attendees),
+            rng.choice(LOCATIONS),
+            str(rng.choice([5, 5, 6, 8, 10])),
+            "Y" if rng.random() < 0.3 else "N",
+            baby,
+            "Twisted ankle" if rng.random() < 0.03 else "None",
+        ])
+
+    roster = [["name", "capnumber"]] + [[n, str(i)] for i, n in enumerate(names, start=1)]
+    # Leave the last couple of locations out so geocoding has work to do
+    cache = [["Location", "lat", "lon"]]
+    for loc in LOCATIONS[:-2]:
+        lat, lon = LocalSheetsSource(root).geocode(loc)
+        cache.append([loc, f"{lat:.5f}", f"{lon:.5f}"])
+
+    sheets = {
+        (sheet_name, "Run Club Meets"): meets,
+        (sheet_name, "Runners"): roster,
+        ("locations_cache", LocalSheetsSource.FIRST_SHEET): cache,
+    }
+    for (workbook, worksheet), rows in sheets.items():
+        os.makedirs(os.path.join(root, workbook), exist_ok=True)
+        with open(os.path.join(root, workbook, f"{worksheet}.csv"), "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run Club data source utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    synth = sub.add_parser("synth", help="write a synthetic club for LocalSheetsSource")
+    synth.add_argument("root")
+    synth.add_argument("--sheet-name", default="Arrowe Park ED Run Club")
+    synth.add_argument("--weeks", type=int, default=150)
+    synth.add_argument("--runners", type=int, default=60)
+    synth.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_synthetic_club(args.root, args.sheet_name, args.weeks, args.runners, args.seed)
+    print(f"Wrote synthetic club to {args.root}")
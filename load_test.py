@@ -0,0 +1,200 @@
+# -------------------------------------------------------------
+# Load test for the Run Club Dashboard
+# -------------------------------------------------------------
+# Drives N concurrent headless sessions through
+# running_club_dashboard.py with Streamlit's AppTest, against a
+# synthetic club served by LocalSheetsSource (no network needed).
+#
+# Each session does what people do when the weekly results go out:
+# open the page, type a capnumber into Wrapped, flip the Streaks
+# radio to All-time and back, and (for some sessions) press 🔄.
+#
+#     python load_test.py --sessions 20 --weeks 300 --runners 120
+#
+# Reports per-rerun latency percentiles, CPU, peak RSS, how often
+# the shared dataset was reloaded and the geocode cache hit rate.
+# -------------------------------------------------------------
+
+import argparse
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import club_data
+from data_sources import LocalSheetsSource, generate_synthetic_club
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "running_club_dashboard.py")
+SHEET_NAME = "Arrowe Park ED Run Club"
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def share_script_cache():
+    """Compile the dashboard once for every session, like a real server.
+
+    Each AppTest run normally builds its own ScriptCache and recompiles the
+    script. That adds compile time no real rerun pays, and concurrent
+    ast.parse calls can trip a CPython 3.11 bug ("AST constructor recursion
+    depth mismatch"). One shared, locked cache avoids both.
+
+    This replaces local_script_runner.ScriptCache, which is a Streamlit
+    internal rather than public API: check it still exists and is what
+    AppTest constructs per run whenever Streamlit is upgraded.
+    """
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    shared = ScriptCache()
+    local_script_runner.ScriptCache = lambda: shared
+
+
+def find_widget(widgets, label):
+    for w in widgets:
+        if w.label == label:
+            return w
+    raise LookupError(f"No widget labelled {label!r}")
+
+
+class Session:
+    def __init__(self, session_id, capnumbers, press_refresh, timeout):
+        self.session_id = session_id
+        self.capnumbers = capnumbers
+        self.press_refresh = press_refresh
+        self.timeout = timeout
+        self.latencies = []
+        self.errors = []
+
+    def _rerun(self, step, action):
+        start = time.perf_counter()
+        at = action()
+        self.latencies.append((step, time.perf_counter() - start))
+        if at.exception:
+            self.errors.append(f"{step}: {at.exception[0].value}")
+        return at
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(APP, default_timeout=self.timeout)
+        at = self._rerun("open", at.run)
+        for cap in self.capnumbers:
+            box = find_widget(at.text_input, "Enter your capnumber:")
+            at = self._rerun("wrapped", box.input(str(cap)).run)
+        at = self._rerun("streaks", at.radio[0].set_value("All-time").run)
+        at = self._rerun("streaks", at.radio[0].set_value("Current").run)
+        if self.press_refresh:
+            at = self._rerun("refresh", find_widget(at.button, "🔄").click().run)
+        return self
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return {"p50": value, "p90": value, "p99": value, "max": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p90": cuts[89], "p99": cuts[98], "max": max(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the dashboard")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent sessions")
+    parser.add_argument("--lookups", type=int, default=3, help="capnumbers typed per session")
+    parser.add_argument("--refreshes", type=int, default=1, help="how many sessions press 🔄")
+    parser.add_argument("--weeks", type=int, default=150, help="weeks of synthetic history")
+    parser.add_argument("--runners", type=int, default=60, help="runners in the synthetic roster")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per sheets call")
+    parser.add_argument("--quota-every", type=int, default=0, help="every Nth sheets call fails with a quota error")
+    parser.add_argument("--data-dir", help="use an existing local sheets folder instead of a synthetic one")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed per rerun")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.data_dir:
+        run(args, args.data_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="runclub-sheets-") as data_dir:
+            generate_synthetic_club(data_dir, SHEET_NAME, args.weeks, args.runners, args.seed)
+            run(args, data_dir)
+
+
+def run(args, data_dir):
+    # The dashboard reads these when AppTest executes it in this process
+    os.environ["RUNCLUB_LOCAL_SHEETS"] = data_dir
+    os.environ["RUNCLUB_LOCAL_LATENCY"] = str(args.latency)
+    os.environ["RUNCLUB_LOCAL_QUOTA_EVERY"] = str(args.quota_every)
+    LocalSheetsSource.calls.clear()
+    LocalSheetsSource.reads.clear()
+    club_data.cache_stats.clear()
+    share_script_cache()
+
+    rng = random.Random(args.seed)
+    sessions = [
+        Session(
+            i,
+            [rng.randint(1, args.runners) for _ in range(args.lookups)],
+            press_refresh=i < args.refreshes,
+            timeout=args.timeout,
+        )
+        for i in range(args.sessions)
+    ]
+
+    rss_before = peak_rss_mb()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+    start = threading.Barrier(args.sessions)
+
+    def drive(session):
+        start.wait()
+        return session.run()
+
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        finished = list(pool.map(drive, sessions))
+
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    rss_after = peak_rss_mb()
+
+    reruns = [(step, t) for s in finished for step, t in s.latencies]
+    errors = [e for s in finished for e in s.errors]
+
+    print(f"\nSessions: {args.sessions}   reruns: {len(reruns)}   wall: {wall:.1f}s   errors: {len(errors)}")
+    print(f"Data: {data_dir}  (latency {args.latency}s per call)\n")
+
+    print(f"{'step':<10}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    steps = ["open", "wrapped", "streaks", "refresh", "all"]
+    for step in steps:
+        samples = [t for s, t in reruns if s == step or step == "all"]
+        if not samples:
+            continue
+        p = percentiles(samples)
+        print(f"{step:<10}{len(samples):>6}" + "".join(f"{p[k] * 1000:>10.0f}" for k in ("p50", "p90", "p99", "max")))
+
+    print(f"\nCPU: {cpu:.1f}s total, {cpu / args.sessions:.2f}s per session")
+    print(f"Peak RSS: {rss_after:.0f} MB ({(rss_after - rss_before) / args.sessions:.1f} MB per session above baseline)")
+
+    stats = club_data.cache_stats
+    print(f"Shared dataset: {stats['dataset_loads']} loads, {stats['dataset_checks']} change checks")
+    calls, misses = stats["locations_cache_calls"], stats["locations_cache_misses"]
+    if calls:
+        print(f"Geocode cache: {calls - misses} hits, {misses} misses -> hit rate {1 - misses / calls:.1%}")
+    print(f"Sheets calls: {dict(LocalSheetsSource.calls)}")
+
+    if errors:
+        print("\nErrors:")
+        for e in errors[:10]:
+            print(f"  {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -29,14 +29,17 @@ import os
 #st.write("Files in app directory:", os.listdir())
 import json
 from oauth2client.service_account import ServiceAccountCredentials
-import gspread
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
 from datetime import datetime
+from data_sources import GoogleSheetsSource, LocalSheetsSource, with_retries
+from club_data import DatasetRefresher, MILESTONES, PINTS_PER_RUNNER, count_stat
+
+# Sessions share one dataset and get shallow views of it (club_data.py);
+# copy-on-write makes a session's edits copy the columns instead of
+# changing everyone's data. Always on from pandas 3.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-secrets = st.secrets["google_sheets"]
-creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(secrets), scope)
 
 # ------------------------
 # CONFIG
@@ -44,6 +47,19 @@ creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(secrets), scope)
 
 SHEET_NAME = "Arrowe Park ED Run Club"
 
+# Point RUNCLUB_LOCAL_SHEETS at a folder of CSV worksheets (see data_sources.py)
+# to run the dashboard offline. The other settings only apply to the local source.
+LOCAL_SHEETS_DIR = os.environ.get("RUNCLUB_LOCAL_SHEETS")
+LOCAL_LATENCY = float(os.environ.get("RUNCLUB_LOCAL_LATENCY", 0))
+LOCAL_QUOTA_EVERY = int(os.environ.get("RUNCLUB_LOCAL_QUOTA_EVERY", 0))
+LOCAL_MAX_ROWS = int(os.environ["RUNCLUB_LOCAL_MAX_ROWS"]) if os.environ.get("RUNCLUB_LOCAL_MAX_ROWS") else None
+
+# How often (seconds) the background refresher checks the sheets for changes.
+# At least 10s, so a 0 or negative setting can't hammer the Sheets quota.
+REFRESH_INTERVAL = max(10.0, float(os.environ.get("RUNCLUB_REFRESH_SECONDS", 300)))
+# Set to 1 to check every incremental update of the club totals against a full rebuild
+VERIFY_DERIVED = os.environ.get("RUNCLUB_VERIFY_DERIVED") == "1"
+
 # ------------------------
 # Mobile Mode Toggle
 # ------------------------
@@ -51,85 +67,30 @@ SHEET_NAME = "Arrowe Park ED Run Club"
 #st.sidebar.markdown("📱 **View Settings**")
 #mobile_mode = st.sidebar.checkbox("Enable Mobile Mode", value=False)
 
-# ------------------------
-# STREAK FUNCTIONS (moved up to support Wrapped)
-# ------------------------
-
-def longest_streak_by_week(weeks):
-    # Floor all week values and remove nulls
-    normalized = sorted(set(int(np.floor(w)) for w in weeks if pd.notnull(w)))
-    if not normalized:
-        return 0
-
-    streak = max_streak = 1
-    for i in range(1, len(normalized)):
-        if normalized[i] == normalized[i - 1] + 1:
-            streak += 1
-        else:
-            streak = 1
-        max_streak = max(max_streak, streak)
-    return max_streak
-
-def current_streak_by_week(weeks, all_weeks):
-    runner_weeks = set(int(np.floor(w)) for w in weeks if pd.notnull(w))
-    all_weeks = sorted(set(int(np.floor(w)) for w in all_weeks if pd.notnull(w)))
-
-    if not runner_weeks or not all_weeks:
-        return 0
-
-    streak = 0
-    for week in reversed(all_weeks):
-        if week in runner_weeks:
-            streak += 1
-        else:
-            break  # first missed week ends the streak
-
-    return streak
-
 # ------------------------
 # AUTH + LOAD DATA
 # ------------------------
 
-@st.cache_data
-def load_sheets():
-    import gspread
-    client = gspread.authorize(creds)
-    workbook = client.open(SHEET_NAME)
-
-    meets_sheet = workbook.worksheet("Run Club Meets")
-    values = meets_sheet.get_all_values()
-    headers = values[0]
-    data = values[1:]
-
-    df_meets = pd.DataFrame(data, columns=headers)
-    df_meets.rename(columns={
-        headers[0]: "Week",
-        headers[1]: "Date",
-        headers[2]: "Runners",
-        headers[3]: "Location",
-        headers[4]: "Distance"
-    }, inplace=True)
-
-    df_meets = df_meets[df_meets['Date'].str.strip() != ""]
-    df_meets['Date'] = df_meets['Date'].apply(lambda x: str(x).strip())
-    df_meets['Date'] = pd.to_datetime(df_meets['Date'], errors='coerce', dayfirst=True)
-    df_meets = df_meets.dropna(subset=['Date'])
-    df_meets['RunnerList'] = df_meets['Runners'].apply(lambda x: [r.strip() for r in x.split(',') if r.strip()])
-    df_meets['Distance'] = pd.to_numeric(df_meets['Distance'], errors='coerce')
-    df_meets['Week'] = pd.to_numeric(df_meets['Week'], errors='coerce')
-
-    runners_sheet = workbook.worksheet("Runners")
-    df_runners = pd.DataFrame(runners_sheet.get_all_records())
-    df_runners['name'] = df_runners['name'].str.strip()
-
-        # Handle optional Pints Consumed column
-    if "Pints Consumed" in df_meets.columns:
-        df_meets["Pints Consumed"] = df_meets["Pints Consumed"].str.strip().str.upper()
-    else:
-        df_meets["Pints Consumed"] = ""
+@st.cache_resource
+def get_data_source():
+    # One source (and so one authorised gspread client) per process, shared by
+    # every session and rerun. gspread refreshes the token on expiry.
+    if LOCAL_SHEETS_DIR:
+        return LocalSheetsSource(
+            LOCAL_SHEETS_DIR,
+            latency=LOCAL_LATENCY,
+            quota_every=LOCAL_QUOTA_EVERY,
+            max_rows=LOCAL_MAX_ROWS,
+        )
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(st.secrets["google_sheets"]), scope)
+    return GoogleSheetsSource(creds)
 
-    
-    return df_meets, df_runners
+@st.cache_resource(show_spinner="Loading run club data…", on_release=lambda refresher: refresher.stop())
+def get_refresher():
+    # Loads the dataset once per process, then keeps it current in the
+    # background; every session reads the same read-only dataset. Clearing
+    # the cache stops the old refresher's thread.
+    return DatasetRefresher(get_data_source(), SHEET_NAME, REFRESH_INTERVAL, verify=VERIFY_DERIVED)
 
 def render_baby_count(df, runners_df, position="top", recent_baby=True):
     """Render the Run Club Baby Count section."""
@@ -140,7 +101,6 @@ def render_baby_count(df, runners_df, position="top", recent_baby=True):
 
     # --- Prepare recent vs older babies based on week number ---
     if "Week" in df.columns:
-        df["Week"] = pd.to_numeric(df["Week"], errors="coerce")
         latest_week = df["Week"].max()
         recent_cutoff = 2
         recent_babies = df[
@@ -258,9 +218,10 @@ def render_baby_count(df, runners_df, position="top", recent_baby=True):
    # st.markdown("---")
 
 
-df, runners_df = load_sheets()
-exploded = df.explode('RunnerList')
-exploded['Runner'] = exploded['RunnerList'].str.strip()
+dataset = get_refresher().dataset
+df, runners_df, locations_cache_df, exploded, ingest_report = dataset.views()
+# Club-wide totals, counts and streaks, kept up to date a week at a time
+derived = dataset.derived
 
 # --- Check if there's been a new baby in the last 2 weeks ---
 recent_cutoff = 2  # weeks
@@ -295,9 +256,11 @@ else:
 # Create a 3-column layout and place the button in the rightmost column
 col1, col2, col3 = st.columns([8, 1, 1])
 with col3:
-    if st.button("🔄", help="Click to reload Google Sheet"):
-        st.cache_data.clear()
-        st.rerun()
+    if st.button("🔄", help="Check the Google Sheet for new data"):
+        # The background refresher does the check, so nobody waits on the sheet;
+        # new data (if any) shows up on the next rerun
+        get_refresher().request_check()
+        st.toast("Checking for new data… 🔄")
 
 st.markdown(
     """
@@ -379,39 +342,23 @@ st.markdown("""
 st.sidebar.header("🔍 Runner Registry")
 runners_display = runners_df[['name', 'capnumber']].copy()
 
-run_counts = exploded['Runner'].value_counts()
+run_counts = derived.run_counts
+# Highest milestone reached, e.g. 🥉 for 25-49 runs
 badges = []
 for name in runners_display['name']:
     count = run_counts.get(name, 0)
-    if count >= 100:
-        badges.append("🏅")
-    elif count >= 50:
-        badges.append("🥈")
-    elif count >= 25:
-        badges.append("🥉")
-    elif count >= 20:
-        badges.append("🚀")
-    elif count >= 15:
-        badges.append("⚡")
-    elif count >= 10:
-        badges.append("🔟")
-    elif count >= 5:
-        badges.append("5️⃣")
-    else:
-        badges.append("")
+    reached = [runs for runs in MILESTONES if count >= runs]
+    badges.append(MILESTONES[max(reached)] if reached else "")
 
 runners_display['🎖️'] = badges
 st.sidebar.dataframe(runners_display, hide_index=True, use_container_width=True)
 
-st.sidebar.markdown("""
-5️⃣ – 5+ runs  
-🔟 – 10+ runs  
-⚡ – 15+ runs  
-🚀 – 20+ runs  
-🥉 – 25+ runs  
-🥈 – 50+ runs  
-🏅 – 100+ runs
-""")
+st.sidebar.markdown("  \n".join(f"{badge} – {runs}+ runs" for runs, badge in sorted(MILESTONES.items())))
+
+# Rows the loader dropped or cleaned up, so sheet typos don't vanish silently
+if not ingest_report.empty:
+    with st.sidebar.expander(f"🧾 Data checks ({len(ingest_report)})"):
+        st.dataframe(ingest_report, hide_index=True, use_container_width=True)
 
 
 # ------------------------
@@ -451,8 +398,7 @@ if cap_input:
             most_common_location = runner_df['Location'].value_counts().idxmax()
             total_km = round(runner_df['Distance'].sum(), 1)
 
-            runner_weeks = runner_df['Week']
-            longest_runner_streak = longest_streak_by_week(runner_weeks)
+            longest_runner_streak = derived.longest_streaks.get(runner_name, 0)
 
             first_run_fmt = first_run.strftime('%d/%m/%Y')
             last_run_fmt = last_run.strftime('%d/%m/%Y')
@@ -503,7 +449,25 @@ if cap_input:
 
             st.altair_chart(chart, use_container_width=True)
 
-
+            # Club Rankings (precomputed distributions, one binary search per metric)
+            rankings = pd.DataFrame(dataset.rankings.rank(runner_name))
+            if not rankings.empty:
+                st.markdown("### 🏅 How You Compare")
+                st.markdown("  \n".join(
+                    f"- **Top {row['Top %']}%** of the club for {row['Metric'].lower()}"
+                    for _, row in rankings.iterrows()
+                ))
+
+                bars = alt.Chart(rankings).mark_bar(cornerRadiusEnd=4).encode(
+                    x=alt.X('Percentile:Q', scale=alt.Scale(domain=[0, 100]), title="Club percentile"),
+                    y=alt.Y('Metric:N', sort=None, title=None),
+                    tooltip=['Metric', alt.Tooltip('Value:Q', format=".1f"), 'Top %', 'Percentile']
+                )
+                median = alt.Chart(pd.DataFrame({'Percentile': [50]})).mark_rule(strokeDash=[4, 4]).encode(
+                    x='Percentile:Q'
+                )
+                st.altair_chart((bars + median).properties(height=180), use_container_width=True)
+                st.caption("Dashed line = club median")
 
             # Detected Run Dates
             #st.markdown("### 📅 Detected Run Dates")
@@ -517,6 +481,9 @@ if cap_input:
             monthly_counts = runs_over_time.copy()
             monthly_counts.index = monthly_counts.index.strftime('%m-%Y')
             monthly_counts_text = monthly_counts.to_string()
+            rankings_text = "\n".join(
+                f"Top {row['Top %']}% for {row['Metric'].lower()}" for _, row in rankings.iterrows()
+            )
 
             summary_text = f"""
 Runner Unwrapped for {runner_name}
@@ -529,6 +496,9 @@ Runner Unwrapped for {runner_name}
 📅 First run: {first_run_fmt}
 📅 Last run: {last_run_fmt}
 
+🏅 Club rankings:
+{rankings_text}
+
 📈 Runs per month:
 {monthly_counts_text}
 """
@@ -553,7 +523,7 @@ if recent_baby:
 # Club Totals + Heatmap + Leaderboard
 # ------------------------
 
-total_club_km = df.apply(lambda row: len(row['RunnerList']) * row['Distance'], axis=1).sum()
+total_club_km = derived.club_km
 st.subheader("📊 Total Distance Run by the Club")
 st.metric(label="Total Distance", value=f"{round(total_club_km, 1)} km", label_visibility="collapsed")
 
@@ -563,29 +533,10 @@ st.metric(label="Total Distance", value=f"{round(total_club_km, 1)} km", label_v
 
 st.subheader("🏆 Latest Milestones")
 
-# Define milestones and corresponding badge emojis
-milestones = {5: "5️⃣", 10: "🔟", 15: "⚡", 20: "🚀", 25: "🥉", 50: "🥈", 100: "🏅"}
-
-# Gather all run dates per runner, sorted
-runner_run_dates = exploded[['Runner', 'Date']].dropna().sort_values(['Runner', 'Date'])
-
-# Record when each runner hit each milestone
-milestone_events = []
-
-for runner in runner_run_dates['Runner'].unique():
-    dates = runner_run_dates[runner_run_dates['Runner'] == runner].sort_values('Date')['Date'].reset_index(drop=True)
-    for milestone in milestones:
-        if len(dates) >= milestone:
-            milestone_events.append({
-                "Runner": runner,
-                "Runs": milestone,
-                "Date": dates.iloc[milestone - 1],
-                "Badge": milestones[milestone]
-            })
-
 # Convert and display the last 3 awards
-awards_df = pd.DataFrame(milestone_events)
-awards_df = awards_df.sort_values("Date", ascending=False).head(3)
+awards_df = pd.DataFrame(derived.milestone_events)
+if not awards_df.empty:
+    awards_df = awards_df.sort_values("Date", ascending=False).head(3)
 
 if not awards_df.empty:
     for _, row in awards_df.iterrows():
@@ -595,18 +546,13 @@ else:
 
 # --- 🍺 Run Club Pints Consumed ---
 if "Pints Consumed" in df.columns:
-    # Identify weeks with a Y
-    pint_weeks = df[df["Pints Consumed"].str.upper() == "Y"].copy()
+    # Weeks with a Y, each earning 0.8 × number of runners
+    pint_weeks = pd.DataFrame(derived.pint_weeks, columns=["Week", "Estimated Pints"])
 
-    # Each Y week earns 0.8 × number of runners
-    pint_weeks["Estimated Pints"] = pint_weeks["Runners"].apply(
-        lambda r: 0.8 * len([x for x in str(r).split(",") if x.strip()])
-    )
-
-    total_pints = pint_weeks["Estimated Pints"].sum().round(1)
+    total_pints = round(derived.total_pints, 1)
     average_pints = (
-        total_pints / len(df[df["Pints Consumed"].str.strip() != ""])
-        if len(df[df["Pints Consumed"].str.strip() != ""]) > 0
+        total_pints / derived.pints_logged
+        if derived.pints_logged > 0
         else 0
     )
 
@@ -617,7 +563,7 @@ if "Pints Consumed" in df.columns:
     )
 
     # Optional fun fact
-    st.caption("(*Assumes 80% of runners get a pint on pub weeks — cheers!*)")
+    st.caption(f"(*Assumes {PINTS_PER_RUNNER:.0%} of runners get a pint on pub weeks — cheers!*)")
 
     # --- Weekly Pints Chart ---
     import altair as alt
@@ -654,31 +600,23 @@ if "Pints Consumed" in df.columns:
 # ------------------------
 
 @st.cache_data(show_spinner=False)
-def load_or_update_locations_cache(location_counts):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(st.secrets["google_sheets"]), scope)
-    client = gspread.authorize(creds)
-
-    # Open the cache sheet
-    sheet = client.open("locations_cache").sheet1
-    existing_data = sheet.get_all_records()
-    locations_cache = pd.DataFrame(existing_data)
-
+def load_or_update_locations_cache(location_counts, locations_cache):
+    # The cache sheet itself is fetched alongside the meets by get_refresher()
+    count_stat("locations_cache_misses")
     known = set(locations_cache['Location'])
     current = set(location_counts['Location'])
     missing = list(current - known)
 
     if datetime.today().weekday() in [4,5,6]:  # Updates on Fridays/Sat/Sun onlys or change to in [3, 4]:
         if missing:
-            geolocator = Nominatim(user_agent="runclub-geocoder")
-            geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+            source = get_data_source()
             new_rows = []
             for loc in missing:
                 try:
-                    g = geocode(loc)
+                    g = source.geocode(loc)
                     if g:
-                        new_rows.append({"Location": loc, "lat": g.latitude, "lon": g.longitude})
-                        sheet.append_row([loc, g.latitude, g.longitude])
+                        new_rows.append({"Location": loc, "lat": g[0], "lon": g[1]})
+                        with_retries(source.append_row, "locations_cache", [loc, g[0], g[1]])
                 except Exception:
                     continue
             if new_rows:
@@ -693,8 +631,9 @@ def load_or_update_locations_cache(location_counts):
 
 st.subheader("🗺️ Run Location Heatmap")
 
-location_counts = df.groupby('Location').size().reset_index(name='count')
-locations_cache = load_or_update_locations_cache(location_counts)
+location_counts = pd.DataFrame(list(derived.location_counts.items()), columns=['Location', 'count'])
+count_stat("locations_cache_calls")
+locations_cache = load_or_update_locations_cache(location_counts, locations_cache_df)
 location_counts = location_counts.merge(locations_cache, on="Location", how="left")
 location_counts = location_counts.dropna(subset=['lat', 'lon'])
 
@@ -706,8 +645,7 @@ HeatMap(heat_data).add_to(location_map)
 components.html(location_map._repr_html_(), height=350)
 
 st.subheader("🏅 Most Frequent Attenders")
-filtered = exploded['Runner'].value_counts().reset_index()
-filtered.columns = ['Runner', 'Count']
+filtered = pd.DataFrame(list(run_counts.items()), columns=['Runner', 'Count'])
 filtered = filtered[filtered['Count'] >= 3]
 chart = alt.Chart(filtered).mark_bar().encode(
     x=alt.X('Runner', sort='-y'),
@@ -729,21 +667,12 @@ st.altair_chart(chart, use_container_width=True)
 st.subheader("🔥 Streaks")
 streak_mode = st.radio("Select", ["Current", "All-time"], horizontal=True, label_visibility="collapsed")
 
-streak_data = []
-all_weeks = df['Week'].unique()
-
-for runner in exploded['Runner'].unique():
-    weeks = exploded[exploded['Runner'] == runner]['Week']
-    if streak_mode == "Current":
-        streak = current_streak_by_week(weeks, all_weeks)
-        label = "Current Streak"
-        if streak >= 2:
-            streak_data.append((runner, streak))
-    else:
-        streak = longest_streak_by_week(weeks)
-        label = "Longest Streak"
-        if streak >= 3:
-            streak_data.append((runner, streak))
+if streak_mode == "Current":
+    label = "Current Streak"
+    streak_data = [(runner, streak) for runner, streak in derived.current_streaks.items() if streak >= 2]
+else:
+    label = "Longest Streak"
+    streak_data = [(runner, streak) for runner, streak in derived.longest_streaks.items() if streak >= 3]
 
 streak_df = pd.DataFrame(streak_data, columns=['Runner', label]).sort_values(by=label, ascending=False).reset_index(drop=True)
 # Show 4+ week streak popup for top runner in current mode